@@ -1,19 +1,64 @@
 # app.py - WITH GPU/CPU AUTO-DETECTION & MASK CACHING
-from flask import Flask, request, jsonify
+import os
+
+# CUDA settings must be in place before torch is imported below
+os.environ.setdefault('CUDA_MODULE_LOADING', 'LAZY')
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '0')
+# Let the caching allocator grow segments in place instead of fragmenting on varying sizes
+os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', 'expandable_segments:True')
+
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import cv2
 import numpy as np
 import base64
-import os
+import io
 import logging
+import time
 from datetime import datetime
 import traceback
 import hashlib
+import string
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Tuple
 import torch
-
-from improved_sam_visualizer import ImprovedWallPaintVisualizer
+from PIL import Image
+
+try:
+    import blake3
+except ImportError:  # optional: fall back to hashlib.blake2b
+    blake3 = None
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to Flask's json module
+    orjson = None
+
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+except Exception:  # optional: PyTurboJPEG or the libturbojpeg library is missing
+    turbo_jpeg = None
+
+from improved_sam_visualizer import ImprovedWallPaintVisualizer, WallMasks
+from mask_cache import MaskCache
+from detection_worker import DetectionWorker
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (native encoder, releases the GIL)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 app.secret_key = os.getenv('SECRET_KEY', 'change-this-to-random-string-in-production')
 
 # CORS Configuration
@@ -31,6 +76,25 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 UPLOAD_FOLDER = 'temp_uploads'
 RESULTS_FOLDER = 'results'
 SAM_CHECKPOINT = 'models/sam_vit_h_4b8939.pth'
+MASK_CACHE_MAX_ENTRIES = int(os.getenv('MASK_CACHE_MAX_ENTRIES', '32'))
+MASK_CACHE_MAX_MB = int(os.getenv('MASK_CACHE_MAX_MB', '2048'))
+MASK_CACHE_PERSIST = os.getenv('MASK_CACHE_PERSIST', 'true').lower() == 'true'
+MASK_CACHE_MAX_DISK_MB = int(os.getenv('MASK_CACHE_MAX_DISK_MB', '4096'))
+JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', '90'))
+SAM_CPU_QUANTIZE = os.getenv('SAM_CPU_QUANTIZE', 'true').lower() == 'true'
+SAM_GPU_HALF_PRECISION = os.getenv('SAM_GPU_HALF_PRECISION', 'true').lower() == 'true'
+SAM_TORCH_COMPILE = os.getenv('SAM_TORCH_COMPILE', 'true').lower() == 'true'
+DETECTION_TIMEOUT = 120  # seconds a request waits for its queued detection
+PAINT_REQUESTS_MAX = 4096  # paint parameters remembered for re-rendering expired results
+DEFAULT_PAINT_COLOR = (255, 87, 51)
+MAX_IMAGE_SIDE = int(os.getenv('MAX_IMAGE_SIDE', '2048'))  # larger uploads are decoded reduced
+
+# libjpeg can scale by 1/2, 1/4 or 1/8 inside the IDCT - far cheaper than a full decode + resize
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -56,8 +120,86 @@ device_info = {
     'available': False
 }
 
-# In-memory cache for masks
-mask_cache = {}
+# LRU cache for masks (in memory, persisted to RESULTS_FOLDER across restarts)
+mask_cache = MaskCache(
+    max_entries=MASK_CACHE_MAX_ENTRIES,
+    max_bytes=MASK_CACHE_MAX_MB * 1024 * 1024,
+    persist_dir=RESULTS_FOLDER if MASK_CACHE_PERSIST else None,
+    max_disk_bytes=MASK_CACHE_MAX_DISK_MB * 1024 * 1024
+)
+
+def run_detection(image_hash, image):
+    """Called on the detection worker thread - the only thread that runs SAM.
+    
+    Detects, resizes and caches the masks, so a request that timed out waiting
+    for them still finds the result in the cache when the client retries.
+    """
+    cached_data = mask_cache.get(image_hash)
+    if cached_data is not None:
+        # An identical upload was queued while this image was being detected
+        return cached_data
+    
+    start_time = time.perf_counter()
+    wall_segments, scale_factor = visualizer.detect_walls_improved(image)
+    detection_time = time.perf_counter() - start_time
+    
+    logger.info(f"✅ Detection complete in {detection_time:.2f}s")
+    logger.info(f"   Found {len(wall_segments)} wall segments")
+    
+    entry = {
+        'wall_info': [],
+        'image_size': {'width': image.shape[1], 'height': image.shape[0]},
+        'detection_time': detection_time
+    }
+    
+    if wall_segments:
+        resized_segments = visualizer.resize_masks_to_original(
+            wall_segments, image.shape, scale_factor
+        )
+        # One contiguous bit-packed mask stack + per-wall metadata arrays
+        walls = WallMasks.from_segments(resized_segments, image.shape)
+        
+        entry.update({
+            'walls': walls,
+            'original_image': image,
+            'wall_info': build_wall_info(walls, image.shape),
+            'timestamp': datetime.now().isoformat()
+        })
+        mask_cache.put(image_hash, entry)
+        
+        logger.info(f"💾 Cached {len(walls)} masks for image {image_hash}")
+    else:
+        logger.warning("⚠️  No walls detected in image")
+    
+    return entry
+
+# token -> (wall_ids, color_rgb, opacity, main_walls_only) of recent paint requests,
+# so paint_result() can re-render a result the paint cache has already dropped
+paint_requests = OrderedDict()
+paint_requests_lock = threading.Lock()
+
+def remember_paint_request(token, params):
+    """Keep a paint request's parameters, dropping the oldest past PAINT_REQUESTS_MAX"""
+    with paint_requests_lock:
+        paint_requests[token] = params
+        paint_requests.move_to_end(token)
+        while len(paint_requests) > PAINT_REQUESTS_MAX:
+            paint_requests.popitem(last=False)
+
+def render_paint(image_hash, cached_data, paint_key, params) -> bytes:
+    """Paint a cached image, cache the encoded JPEG under paint_key and return it"""
+    wall_ids, color_rgb, opacity, main_walls_only = params
+    # apply_smart_paint composes into its own buffer and never writes to the cached image
+    painted_image = visualizer.apply_smart_paint(
+        cached_data['original_image'], cached_data['walls'], color_rgb, opacity,
+        main_walls_only, wall_ids=list(wall_ids)
+    )
+    result_jpeg = encode_jpeg(painted_image)
+    mask_cache.put_paint(image_hash, paint_key, result_jpeg)
+    return result_jpeg
+
+# Serializes SAM access (its predictor keeps per-image state)
+detection_worker = DetectionWorker(run_detection)
 
 def detect_device():
     """Detect available device (GPU/CPU) and log details"""
@@ -66,6 +208,9 @@ def detect_device():
     logger.info("=" * 60)
     logger.info("🔍 DEVICE DETECTION")
     logger.info("=" * 60)
+    logger.info(f"   CUDA_MODULE_LOADING: {os.environ.get('CUDA_MODULE_LOADING')}")
+    logger.info(f"   CUDA_VISIBLE_DEVICES: {os.environ.get('CUDA_VISIBLE_DEVICES')}")
+    logger.info(f"   PYTORCH_CUDA_ALLOC_CONF: {os.environ.get('PYTORCH_CUDA_ALLOC_CONF')}")
     
     # Check CUDA availability
     cuda_available = torch.cuda.is_available()
@@ -99,9 +244,109 @@ def detect_device():
     
     return device_info['type']
 
-def get_image_hash(image_data: str) -> str:
-    """Generate unique hash for image"""
-    return hashlib.md5(image_data.encode()).hexdigest()[:16]
+def decode_image_payload(image_data: str) -> bytes:
+    """Decode a base64 image payload, with or without a data URL header"""
+    # The header ("data:image/jpeg;base64,") is short - never scan the whole payload for it
+    marker = image_data.find('base64,', 0, 64)
+    if marker != -1:
+        image_data = image_data[marker + len('base64,'):]
+    return base64.b64decode(image_data)
+
+def decode_image(image_bytes: bytes):
+    """Decode uploaded bytes to a BGR image, never keeping much more than MAX_IMAGE_SIDE"""
+    flag = cv2.IMREAD_COLOR
+    
+    try:
+        # Reads only the header to get the dimensions
+        longest_side = max(Image.open(io.BytesIO(image_bytes)).size)
+    except Exception:
+        longest_side = 0  # let OpenCV decide whether it can decode this
+    
+    # Largest reduction that still leaves at least MAX_IMAGE_SIDE pixels
+    for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+        if longest_side // factor >= MAX_IMAGE_SIDE:
+            flag = reduced_flag
+            break
+    
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+
+def get_image_hash(image_bytes: bytes) -> str:
+    """Generate unique hash for decoded image bytes (BLAKE3, blake2b fallback)"""
+    if blake3 is not None:
+        return blake3.blake3(image_bytes).hexdigest(length=8)
+    return hashlib.blake2b(image_bytes, digest_size=8).hexdigest()
+
+def encode_jpeg(image: np.ndarray) -> bytes:
+    """Encode a BGR image as JPEG, using libjpeg-turbo directly when available"""
+    if turbo_jpeg is not None:
+        return turbo_jpeg.encode(np.ascontiguousarray(image), quality=JPEG_QUALITY)
+    _, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return encoded.tobytes()
+
+@lru_cache(maxsize=256)
+def parse_hex_color(color_hex: str) -> Tuple[int, int, int]:
+    """Convert '#RRGGBB' to an (r, g, b) tuple, falling back to the default paint color"""
+    color_hex = color_hex.lstrip('#')
+    if len(color_hex) != 6 or not all(c in string.hexdigits for c in color_hex):
+        return DEFAULT_PAINT_COLOR
+    value = int(color_hex, 16)
+    return ((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
+def get_paint_key(wall_ids, color_rgb, opacity, main_walls_only) -> str:
+    """Short digest identifying one paint result of an image (used in URLs and ETags)"""
+    params = repr((tuple(wall_ids), tuple(color_rgb), opacity, main_walls_only)).encode()
+    return hashlib.blake2b(params, digest_size=8).hexdigest()
+
+def build_wall_info(walls: WallMasks, image_shape) -> list:
+    """JSON-ready per-wall metadata; numeric columns are converted in bulk via NumPy"""
+    percentages = walls.areas / (image_shape[0] * image_shape[1]) * 100
+    
+    return [{
+        'id': i,
+        'area': area,
+        'confidence': confidence,
+        'wall_type': wall_type,
+        'bbox': bbox,
+        'area_percentage': percentage
+    } for i, (area, confidence, wall_type, bbox, percentage) in enumerate(zip(
+        walls.areas.tolist(), walls.confidences.tolist(),
+        walls.wall_types.tolist(), walls.bboxes.tolist(), percentages.tolist()
+    ))]
+
+def quantize_visualizer_for_cpu():
+    """Dynamic int8 quantization of the SAM image encoder's Linear layers (CPU only)"""
+    logger.info("🔧 Quantizing SAM image encoder to int8 for CPU inference...")
+    
+    try:
+        # Prefer the backends with VNNI/AMX int8 kernels
+        for engine in ('x86', 'onednn', 'fbgemm'):
+            if engine in torch.backends.quantized.supported_engines:
+                torch.backends.quantized.engine = engine
+                break
+        
+        visualizer.sam.image_encoder = torch.ao.quantization.quantize_dynamic(
+            visualizer.sam.image_encoder, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        logger.info(f"✅ Encoder quantized (engine: {torch.backends.quantized.engine})")
+    except Exception as e:
+        logger.warning(f"⚠️  Quantization failed, keeping FP32 encoder: {str(e)}")
+
+def warm_up_visualizer():
+    """Run one dummy detection so CUDA/cuDNN init happens at startup, not on the first request"""
+    logger.info("🔥 Warming up SAM with a dummy forward pass...")
+    start_time = time.perf_counter()
+    
+    try:
+        dummy_image = np.zeros((512, 512, 3), np.uint8)
+        visualizer.detect_walls_improved(dummy_image)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        
+        warmup_time = time.perf_counter() - start_time
+        logger.info(f"✅ Warm-up complete in {warmup_time:.2f}s")
+    except Exception as e:
+        # A failed warm-up only costs first-request latency, never startup
+        logger.warning(f"⚠️  Warm-up failed: {str(e)}")
 
 def initialize_visualizer():
     """Initialize SAM visualizer with auto device detection"""
@@ -127,12 +372,28 @@ def initialize_visualizer():
         # Detect device
         device = detect_device()
         
+        if device == 'cpu':
+            # All cores for intra-op parallelism (GEMMs); no inter-op thread pool
+            torch.set_num_threads(os.cpu_count())
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                pass  # only settable before the first parallel op
+        
         # Initialize visualizer
         logger.info(f"🔄 Loading SAM model from: {SAM_CHECKPOINT}")
         logger.info(f"📦 Model size: ~2.5GB")
         logger.info("⏳ This may take 10-30 seconds...")
         
-        visualizer = ImprovedWallPaintVisualizer(SAM_CHECKPOINT)
+        visualizer = ImprovedWallPaintVisualizer(
+            SAM_CHECKPOINT,
+            half_precision=SAM_GPU_HALF_PRECISION,
+            compile_encoder=SAM_TORCH_COMPILE
+        )
+        if device == 'cpu' and SAM_CPU_QUANTIZE:
+            quantize_visualizer_for_cpu()
+        warm_up_visualizer()
+        detection_worker.start()
         
         logger.info("=" * 60)
         logger.info("✅ SAM VISUALIZER READY!")
@@ -165,6 +426,7 @@ def health_check():
         'model_path': SAM_CHECKPOINT,
         'model_exists': os.path.exists(SAM_CHECKPOINT),
         'cached_images': len(mask_cache),
+        'cache_bytes': mask_cache.total_bytes,
         'device': device_info,
         'pytorch_version': torch.__version__,
         'cuda_available': torch.cuda.is_available()
@@ -188,23 +450,26 @@ def detect_walls_only():
                 'model_exists': os.path.exists(SAM_CHECKPOINT)
             }), 500
 
-        data = request.get_json()
-        if not data or 'image' not in data:
-            return jsonify({'error': 'No image data provided', 'success': False}), 400
-
-        image_data = data['image']
-        if 'base64,' in image_data:
-            image_data_clean = image_data.split('base64,')[1]
+        # Decode once - the raw bytes feed both the hash and cv2.imdecode
+        if request.mimetype == 'multipart/form-data':
+            # Raw file upload - no base64 inflation or decoding
+            upload = request.files.get('image')
+            image_bytes = upload.read() if upload else b''
         else:
-            image_data_clean = image_data
+            data = request.get_json()
+            if not data or 'image' not in data:
+                return jsonify({'error': 'No image data provided', 'success': False}), 400
+            image_bytes = decode_image_payload(data['image'])
+        
+        if not image_bytes:
+            return jsonify({'error': 'No image data provided', 'success': False}), 400
         
-        # Generate hash for this image
-        image_hash = get_image_hash(image_data_clean)
+        image_hash = get_image_hash(image_bytes)
         
         # Check if already processed
-        if image_hash in mask_cache:
+        cached_data = mask_cache.get(image_hash)
+        if cached_data is not None:
             logger.info(f"🎯 CACHE HIT! Using cached masks for image {image_hash}")
-            cached_data = mask_cache[image_hash]
             
             return jsonify({
                 'success': True,
@@ -224,60 +489,24 @@ def detect_walls_only():
             logger.info("   ⏱️  CPU mode: This will take 20-30 seconds...")
         
         # Decode image
-        image_bytes = base64.b64decode(image_data_clean)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image = decode_image(image_bytes)
 
         if image is None:
             return jsonify({'error': 'Could not decode image', 'success': False}), 400
 
         logger.info(f"   Image shape: {image.shape}")
         
-        # Detect walls
-        start_time = datetime.now()
-        wall_segments, scale_factor = visualizer.detect_walls_improved(image)
-        detection_time = (datetime.now() - start_time).total_seconds()
-        
-        logger.info(f"✅ Detection complete in {detection_time:.2f}s")
-        logger.info(f"   Found {len(wall_segments)} wall segments")
-        
-        if wall_segments:
-            resized_segments = visualizer.resize_masks_to_original(
-                wall_segments, image.shape, scale_factor
-            )
-            
-            wall_info = [{
-                'id': i,
-                'area': int(segment.area),
-                'confidence': float(segment.confidence),
-                'wall_type': segment.wall_type,
-                'bbox': [int(x) for x in segment.bbox],
-                'area_percentage': float((segment.area / (image.shape[0] * image.shape[1])) * 100)
-            } for i, segment in enumerate(resized_segments)]
-            
-            # Cache the masks
-            mask_cache[image_hash] = {
-                'wall_segments': resized_segments,
-                'original_image': image,
-                'wall_info': wall_info,
-                'image_size': {'width': image.shape[1], 'height': image.shape[0]},
-                'timestamp': datetime.now().isoformat(),
-                'detection_time': detection_time
-            }
-            
-            logger.info(f"💾 Cached {len(resized_segments)} masks for image {image_hash}")
-        else:
-            wall_info = []
-            logger.warning("⚠️  No walls detected in image")
+        # Detect walls (the worker also caches them)
+        result = detection_worker.submit(image_hash, image).result(timeout=DETECTION_TIMEOUT)
 
         return jsonify({
             'success': True,
-            'walls_detected': len(wall_info),
-            'wall_info': wall_info,
-            'image_size': {'width': image.shape[1], 'height': image.shape[0]},
+            'walls_detected': len(result['wall_info']),
+            'wall_info': result['wall_info'],
+            'image_size': result['image_size'],
             'image_hash': image_hash,
             'from_cache': False,
-            'processing_time': detection_time,
+            'processing_time': result['detection_time'],
             'device_used': device_info['type']
         })
 
@@ -304,43 +533,39 @@ def paint_instant():
             return jsonify({'error': 'No data provided', 'success': False}), 400
 
         image_hash = data.get('image_hash')
-        if not image_hash or image_hash not in mask_cache:
+        cached_data = mask_cache.get(image_hash) if image_hash else None
+        if cached_data is None:
             return jsonify({
                 'error': 'Image not found in cache. Please detect walls first.',
                 'success': False
             }), 400
 
-        selected_wall_ids = data.get('wall_ids', [])
+        wall_ids = data.get('wall_ids', [])
+        if not isinstance(wall_ids, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in wall_ids
+        ):
+            return jsonify({
+                'error': 'wall_ids must be a list of integers',
+                'success': False
+            }), 400
+
+        selected_wall_ids = sorted(set(wall_ids))
         color_hex = data.get('color', '#FF5733')
-        opacity = float(data.get('opacity', 0.7))
+        opacity = round(float(data.get('opacity', 0.7)), 2)
         main_walls_only = data.get('mainWallsOnly', False)
 
         logger.info(f"⚡ INSTANT PAINT: color={color_hex}, opacity={opacity}, walls={len(selected_wall_ids)}")
 
-        # Get cached data
-        cached_data = mask_cache[image_hash]
-        image = cached_data['original_image']
-        wall_segments = cached_data['wall_segments']
+        walls = cached_data['walls']
 
         # Convert hex to RGB
-        try:
-            color_hex = color_hex.lstrip('#')
-            if len(color_hex) == 6:
-                r = int(color_hex[0:2], 16)
-                g = int(color_hex[2:4], 16)
-                b = int(color_hex[4:6], 16)
-                color_rgb = (r, g, b)
-            else:
-                color_rgb = (255, 87, 51)
-        except:
-            color_rgb = (255, 87, 51)
+        color_rgb = parse_hex_color(color_hex) if isinstance(color_hex, str) else DEFAULT_PAINT_COLOR
 
         # Filter walls
         if selected_wall_ids:
-            walls_to_paint = [wall_segments[i] for i in selected_wall_ids 
-                            if i < len(wall_segments)]
+            walls_to_paint = [i for i in selected_wall_ids if 0 <= i < len(walls)]
         else:
-            walls_to_paint = wall_segments
+            walls_to_paint = list(range(len(walls)))
 
         if not walls_to_paint:
             return jsonify({
@@ -348,27 +573,37 @@ def paint_instant():
                 'success': False
             }), 400
         
-        # Apply paint instantly
-        start_time = datetime.now()
-        painted_image = visualizer.apply_smart_paint(
-            image.copy(), walls_to_paint, color_rgb, opacity, main_walls_only
-        )
-        paint_time = (datetime.now() - start_time).total_seconds()
+        # Same walls + color + opacity as an earlier request -> reuse the encoded result.
+        # Keyed on the walls actually painted, so out-of-range ids don't split the cache
+        params = (tuple(walls_to_paint), color_rgb, opacity, bool(main_walls_only))
+        paint_key = get_paint_key(*params)
+        token = f"{image_hash}-{paint_key}"
+        remember_paint_request(token, params)
+        if mask_cache.get_paint(image_hash, paint_key) is not None:
+            logger.info(f"🎯 PAINT CACHE HIT for image {image_hash}")
+            return jsonify({
+                'success': True,
+                'token': token,
+                'url': f'/api/paint-instant/{token}',
+                'walls_painted': len(walls_to_paint),
+                'processing_time': 0.0,
+                'from_cache': True
+            })
         
-        # Encode result
-        _, encoded_img = cv2.imencode('.jpg', painted_image, 
-                                    [cv2.IMWRITE_JPEG_QUALITY, 95])
-        result_base64 = base64.b64encode(encoded_img.tobytes()).decode('utf-8')
-        result_data_url = f"data:image/jpeg;base64,{result_base64}"
+        # Apply paint instantly; the encoded result is served as raw JPEG by paint_result()
+        start_time = time.perf_counter()
+        render_paint(image_hash, cached_data, paint_key, params)
+        paint_time = time.perf_counter() - start_time
         
         logger.info(f"✅ Paint complete in {paint_time:.3f}s")
         
         return jsonify({
             'success': True,
-            'result_image': result_data_url,
+            'token': token,
+            'url': f'/api/paint-instant/{token}',
             'walls_painted': len(walls_to_paint),
             'processing_time': paint_time,
-            'from_cache': True
+            'from_cache': False
         })
 
     except Exception as e:
@@ -379,6 +614,32 @@ def paint_instant():
             'success': False
         }), 500
 
+@app.route('/api/paint-instant/<token>', methods=['GET'])
+def paint_result(token):
+    """Painted image as raw JPEG; the token doubles as a strong ETag"""
+    image_hash, _, paint_key = token.partition('-')
+    result_jpeg = mask_cache.get_paint(image_hash, paint_key)
+    if result_jpeg is None:
+        # Dropped from the paint cache since the POST (e.g. its image was evicted);
+        # re-render, reloading the masks from disk if needed
+        with paint_requests_lock:
+            params = paint_requests.get(token)
+        cached_data = mask_cache.get(image_hash) if params is not None else None
+        if cached_data is None or visualizer is None:
+            return jsonify({
+                'error': 'Painted image expired. Please paint again.',
+                'success': False
+            }), 404
+        logger.info(f"🔁 Re-rendering expired paint result for image {image_hash}")
+        result_jpeg = render_paint(image_hash, cached_data, paint_key, params)
+    
+    response = Response(result_jpeg, mimetype='image/jpeg')
+    response.set_etag(token)
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    # Answers If-None-Match with an empty 304
+    return response.make_conditional(request)
+
 @app.route('/api/visualize-masks', methods=['POST', 'OPTIONS'])
 def visualize_masks():
     """Show detected masks using cached data"""
@@ -391,22 +652,21 @@ def visualize_masks():
 
         data = request.get_json()
         image_hash = data.get('image_hash')
+        cached_data = mask_cache.get(image_hash) if image_hash else None
         
-        if image_hash and image_hash in mask_cache:
+        if cached_data is not None:
             logger.info(f"📊 Creating mask visualization from cache")
-            cached_data = mask_cache[image_hash]
             image = cached_data['original_image']
-            wall_segments = cached_data['wall_segments']
+            walls = cached_data['walls']
             
-            vis_image = visualizer.create_mask_visualization(image, wall_segments, 1.0)
+            vis_image = visualizer.create_mask_visualization(image, walls, 1.0)
             
-            _, encoded = cv2.imencode('.jpg', vis_image, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            result_base64 = base64.b64encode(encoded.tobytes()).decode('utf-8')
+            result_base64 = base64.b64encode(encode_jpeg(vis_image)).decode('utf-8')
             
             return jsonify({
                 'success': True,
                 'visualization': f"data:image/jpeg;base64,{result_base64}",
-                'walls_found': len(wall_segments),
+                'walls_found': len(walls),
                 'from_cache': True
             })
         
@@ -426,9 +686,7 @@ def clear_cache():
     if request.method == 'OPTIONS':
         return '', 204
     
-    global mask_cache
-    cache_size = len(mask_cache)
-    mask_cache = {}
+    cache_size = mask_cache.clear()
     logger.info(f"🗑️  Cache cleared ({cache_size} images removed)")
     
     return jsonify({
@@ -452,6 +710,7 @@ if __name__ == '__main__':
         print(f"   GET  /api/health           - Check status")
         print(f"   POST /api/detect-walls     - Detect & cache (slow)")
         print(f"   POST /api/paint-instant    - Paint instantly (fast)")
+        print(f"   GET  /api/paint-instant/<token> - Painted JPEG")
         print(f"   POST /api/visualize-masks  - Show masks")
         print(f"   POST /api/clear-cache      - Clear cache")
         
@@ -0,0 +1,76 @@
+# detection_worker.py - SINGLE SAM WORKER THREAD
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionWorker:
+    """Runs every SAM detection on one background thread.
+
+    Request threads submit (image_hash, image) and wait on a Future. Requests
+    for the same image that are queued together are detected once, and each
+    image's futures are resolved as soon as that image is done - never held
+    back for other images in the queue.
+    """
+
+    def __init__(self, detect: Callable[[str, np.ndarray], Any]):
+        self.detect = detect
+        self._queue = queue.Queue()
+        self._pending = OrderedDict()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='sam-detection', daemon=True)
+            self._thread.start()
+
+    def submit(self, image_hash: str, image: np.ndarray) -> Future:
+        """Queue an image for detection; the future resolves to detect's result"""
+        future = Future()
+        self._queue.put((image_hash, image, future))
+        return future
+
+    def _add(self, item) -> None:
+        image_hash, image, future = item
+        if image_hash not in self._pending:
+            self._pending[image_hash] = (image, [])
+        self._pending[image_hash][1].append(future)
+
+    def _next_image(self):
+        """Oldest pending image with every future queued for it so far"""
+        if not self._pending:
+            self._add(self._queue.get())
+        while True:
+            try:
+                self._add(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        image_hash, (image, futures) = self._pending.popitem(last=False)
+        return image_hash, image, futures
+
+    def _run(self) -> None:
+        while True:
+            image_hash, image, futures = self._next_image()
+            futures = [f for f in futures if f.set_running_or_notify_cancel()]
+            if not futures:
+                continue
+
+            if len(futures) > 1:
+                logger.info(f"🧵 {len(futures)} queued requests share detection of image {image_hash}")
+
+            try:
+                result = self.detect(image_hash, image)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future in futures:
+                future.set_result(result)
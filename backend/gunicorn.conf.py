@@ -0,0 +1,23 @@
+# gunicorn.conf.py - ONE WORKER, MANY THREADS SHARING A SINGLE SAM MODEL
+import os
+
+bind = '0.0.0.0:5000'
+
+# One process holds the ~2.5GB model; threads handle decode/encode work,
+# which runs in OpenCV/NumPy with the GIL released
+workers = 1
+threads = 8
+worker_class = 'gthread'
+
+# The worker sends no heartbeat while it imports wsgi.py, and loading ViT-H,
+# quantizing or torch.compile-ing the encoder and the warm-up detection can
+# together take several minutes. gthread workers keep heartbeating while
+# requests run, so this only bounds startup (and a hung worker)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '600'))
+
+# Heartbeat files on tmpfs instead of disk
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Not preloaded: a CUDA context created in the master does not survive fork(),
+# so the (single) worker loads SAM itself when it imports wsgi.py
+preload_app = False
@@ -1,92 +1,323 @@
 # improved_sam_visualizer.py - FIXED VERSION
 import cv2
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Sequence
 import os
+import logging
+import traceback
 from dataclasses import dataclass
 from segment_anything import sam_model_registry, SamPredictor, SamAutomaticMaskGenerator
+from segment_anything.utils.amg import rle_to_mask
 import torch
+import torch.nn.functional as F
+from paint_kernels import blend_walls
+
+logger = logging.getLogger(__name__)
+
+# ITU-R BT.601 luma weights in B, G, R order, as used by cv2.COLOR_BGR2GRAY.
+# Images stay BGR (as decoded) throughout; only SAM's input is converted to RGB.
+GRAY_WEIGHTS_BGR = np.array([0.114, 0.587, 0.299])
+
+# Pixel standard deviation above which a photo is contrasty enough that CLAHE
+# barely changes SAM's masks, so preprocessing skips it
+CLAHE_SKIP_STD = 45.0
+
+def is_low_contrast(image: np.ndarray) -> bool:
+    """Whether the image is flat enough to need CLAHE, judged on a 64x64 thumbnail"""
+    thumbnail = cv2.resize(image, (64, 64), interpolation=cv2.INTER_AREA)
+    return float(thumbnail.std()) <= CLAHE_SKIP_STD
+
+def mean_brightness(image: np.ndarray, mask: np.ndarray) -> float:
+    """Average gray level of a BGR image under a boolean mask (128 for an empty mask)"""
+    if not mask.any():
+        return 128.0
+    # Luma is linear, so the luma of the masked mean color equals the mean luma
+    mean_bgr = cv2.mean(image, mask=mask.view(np.uint8))[:3]
+    return float(np.dot(mean_bgr, GRAY_WEIGHTS_BGR))
+
+def mask_extents(masks: np.ndarray, width: int) -> np.ndarray:
+    """Tight end-exclusive (x0, y0, x1, y1) box of each packed mask; zeros if empty"""
+    n, h = masks.shape[:2]
+    rows = masks.any(axis=2)
+    cols = np.unpackbits(np.bitwise_or.reduce(masks, axis=1), axis=-1, count=width).astype(bool)
+    
+    extents = np.zeros((n, 4), dtype=np.int32)
+    found = rows.any(axis=1)
+    extents[found, 0] = cols[found].argmax(axis=1)
+    extents[found, 1] = rows[found].argmax(axis=1)
+    extents[found, 2] = width - cols[found, ::-1].argmax(axis=1)
+    extents[found, 3] = h - rows[found, ::-1].argmax(axis=1)
+    return extents
 
 @dataclass
 class WallSegment:
-    mask: np.ndarray
+    """One detected wall; the mask is bit-packed along rows like WallMasks.masks"""
+    packed_mask: np.ndarray
+    width: int
     area: int
     bbox: Tuple[int, int, int, int]
     confidence: float
     wall_type: str
+    avg_brightness: float = 128.0
+    
+    @classmethod
+    def from_mask(cls, mask: np.ndarray, **kwargs) -> "WallSegment":
+        return cls(packed_mask=np.packbits(mask, axis=-1), width=mask.shape[1], **kwargs)
+    
+    @property
+    def mask(self) -> np.ndarray:
+        """Boolean HxW mask, unpacked on demand"""
+        return np.unpackbits(self.packed_mask, axis=-1, count=self.width).view(bool)
+
+@dataclass
+class WallMasks:
+    """Structure-of-arrays store for detected walls.
+    
+    All masks live in one contiguous (N, H, ceil(W/8)) uint8 array, bit-packed
+    along rows; per-wall metadata are parallel arrays with the same indexing.
+    extents are exact pixel bounds computed from the masks (bboxes are SAM's).
+    """
+    masks: np.ndarray
+    width: int
+    areas: np.ndarray
+    bboxes: np.ndarray
+    confidences: np.ndarray
+    wall_types: np.ndarray
+    brightness: np.ndarray
+    extents: Optional[np.ndarray] = None
+    
+    def __post_init__(self):
+        if self.extents is None:
+            self.extents = mask_extents(self.masks, self.width)
+    
+    @classmethod
+    def from_segments(cls, wall_segments: List[WallSegment],
+                      image_shape: Tuple[int, int]) -> "WallMasks":
+        h, w = image_shape[:2]
+        if wall_segments:
+            masks = np.stack([s.packed_mask for s in wall_segments])
+        else:
+            masks = np.zeros((0, h, (w + 7) // 8), dtype=np.uint8)
+        
+        return cls(
+            masks=masks,
+            width=w,
+            areas=np.array([s.area for s in wall_segments], dtype=np.int64),
+            bboxes=np.array([s.bbox for s in wall_segments], dtype=np.int32).reshape(-1, 4),
+            confidences=np.array([s.confidence for s in wall_segments], dtype=np.float64),
+            wall_types=np.array([s.wall_type for s in wall_segments], dtype=str),
+            brightness=np.array([s.avg_brightness for s in wall_segments], dtype=np.float64)
+        )
+    
+    def __len__(self) -> int:
+        return len(self.masks)
+    
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.masks.shape[1], self.width
+    
+    @property
+    def nbytes(self) -> int:
+        return (self.masks.nbytes + self.areas.nbytes + self.bboxes.nbytes +
+                self.confidences.nbytes + self.brightness.nbytes + self.extents.nbytes)
+    
+    def dense(self, index: int) -> np.ndarray:
+        """Boolean HxW mask of one wall"""
+        return np.unpackbits(self.masks[index], axis=-1, count=self.width).view(bool)
+    
+    def dense_crop(self, index: int, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """Boolean mask of one wall inside [y0:y1, x0:x1], unpacking only those bytes"""
+        first_byte = x0 // 8
+        bits = np.unpackbits(self.masks[index, y0:y1, first_byte:(x1 + 7) // 8], axis=-1)
+        return bits[:, x0 - first_byte * 8:x1 - first_byte * 8].view(bool)
+    
+    def extent(self, indices: Sequence[int]) -> Tuple[int, int, int, int]:
+        """Union of the given walls' extents as (x0, y0, x1, y1); all zero if empty"""
+        boxes = self.extents[np.asarray(indices, dtype=np.intp)]
+        boxes = boxes[boxes[:, 2] > boxes[:, 0]]
+        if len(boxes) == 0:
+            return 0, 0, 0, 0
+        return (int(boxes[:, 0].min()), int(boxes[:, 1].min()),
+                int(boxes[:, 2].max()), int(boxes[:, 3].max()))
+
+class ReducedPrecisionEncoder(torch.nn.Module):
+    """Runs the SAM image encoder in bf16/fp16 and hands float32 features to the decoder"""
+    
+    def __init__(self, encoder: torch.nn.Module, dtype: torch.dtype):
+        super().__init__()
+        self.encoder = encoder.to(dtype)
+        self.dtype = dtype
+        self.img_size = encoder.img_size  # read by Sam.preprocess and SamPredictor
+    
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.encoder(x.to(self.dtype)).float()
 
 class ImprovedWallPaintVisualizer:
-    def __init__(self, sam_checkpoint_path: str, model_type: str = "vit_h"):
+    def __init__(self, sam_checkpoint_path: str, model_type: str = "vit_h",
+                 half_precision: bool = True, compile_encoder: bool = True):
         self.sam_checkpoint = sam_checkpoint_path
         self.model_type = model_type
+        self.half_precision = half_precision
+        self.compile_encoder = compile_encoder
         self.sam = None
         self.predictor = None
         self.mask_generator = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {self.device}")
+        logger.info(f"Using device: {self.device}")
+        if self.device == "cuda":
+            torch.set_float32_matmul_precision('high')  # TF32 for the remaining FP32 matmuls
+            torch.backends.cudnn.benchmark = True  # encoder input shape never changes
+        # Built once; detection (the only caller of preprocess_image) runs on one worker thread
+        self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self.gpu_preprocess = self.device == "cuda" and self._init_gpu_preprocess()
         self._load_model()
     
     def _load_model(self):
         """Load SAM model optimized for wall detection"""
         try:
-            print(f"Loading SAM model from: {self.sam_checkpoint}")
+            logger.info(f"Loading SAM model from: {self.sam_checkpoint}")
             if not os.path.exists(self.sam_checkpoint):
                 raise FileNotFoundError(f"SAM checkpoint not found: {self.sam_checkpoint}")
             
             self.sam = sam_model_registry[self.model_type](checkpoint=self.sam_checkpoint)
             self.sam.to(device=self.device)
+            if self.device == "cuda" and self.half_precision:
+                # Tensor-core matmuls for the ViT encoder; the mask decoder keeps
+                # FP32 inputs and weights for its IoU and stability scores
+                dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+                self.sam.image_encoder = ReducedPrecisionEncoder(self.sam.image_encoder, dtype)
+                logger.info(f"Image encoder running in {dtype}")
+            if self.device == "cuda" and self.compile_encoder:
+                self._compile_encoder()
             self.predictor = SamPredictor(self.sam)
             
-            # Optimized settings for wall detection
+            # Optimized settings for wall detection: walls are large, so a coarse
+            # 12x12 prompt grid finds them, decoded in one batch per crop
             self.mask_generator = SamAutomaticMaskGenerator(
                 model=self.sam,
-                points_per_side=32,
+                points_per_side=12,
+                points_per_batch=144,
                 pred_iou_thresh=0.75,
                 stability_score_thresh=0.9,
                 crop_n_layers=1,
                 min_mask_region_area=1000,
                 box_nms_thresh=0.6,
+                # Masks come back run-length encoded; detect_walls_improved only
+                # decodes the ones whose bbox survives wall classification
+                output_mode="uncompressed_rle",
             )
-            print("SAM model loaded successfully")
+            logger.info("SAM model loaded successfully")
         except Exception as e:
-            print(f"Error loading SAM model: {e}")
+            logger.error(f"Error loading SAM model: {e}")
             raise
     
+    def _compile_encoder(self):
+        """torch.compile the image encoder, keeping the eager module if that fails"""
+        eager_encoder = self.sam.image_encoder
+        try:
+            # Default mode, not reduce-overhead: CUDA graph outputs are reused
+            # buffers that the next encoder call overwrites
+            self.sam.image_encoder = torch.compile(eager_encoder)
+            
+            # The encoder input is always img_size x img_size, so one dummy pass
+            # compiles it now instead of on the first request
+            size = eager_encoder.img_size
+            with torch.inference_mode():
+                self.sam.image_encoder(torch.zeros(1, 3, size, size, device=self.device))
+            logger.info("Image encoder compiled with torch.compile")
+        except Exception as e:
+            logger.warning(f"torch.compile failed, running the image encoder eagerly: {e}")
+            self.sam.image_encoder = eager_encoder
+    
+    def _init_gpu_preprocess(self) -> bool:
+        """Set up cv2.cuda filters; False when OpenCV was built without CUDA"""
+        try:
+            if cv2.cuda.getCudaEnabledDeviceCount() == 0:
+                return False
+            # CUDA linear filters only take 1 or 4 channel images
+            self._gpu_blur = cv2.cuda.createGaussianFilter(cv2.CV_8UC4, cv2.CV_8UC4, (3, 3), 0)
+            self._gpu_clahe = cv2.cuda.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            logger.info("Preprocessing on GPU (cv2.cuda)")
+            return True
+        except (AttributeError, cv2.error):
+            return False
+    
+    def _preprocess_gpu(self, image: np.ndarray, size: Tuple[int, int], enhance: bool) -> np.ndarray:
+        """Same resize/blur/CLAHE chain as preprocess_image, on the GPU"""
+        gpu_image = cv2.cuda_GpuMat()
+        gpu_image.upload(image)
+        if size != (image.shape[1], image.shape[0]):
+            gpu_image = cv2.cuda.resize(gpu_image, size, interpolation=cv2.INTER_AREA)
+        
+        gpu_image = cv2.cuda.cvtColor(gpu_image, cv2.COLOR_BGR2RGBA)
+        gpu_image = self._gpu_blur.apply(gpu_image)
+        gpu_image = cv2.cuda.cvtColor(gpu_image, cv2.COLOR_RGBA2RGB)
+        if not enhance:
+            return gpu_image.download()
+        
+        lab = cv2.cuda.cvtColor(gpu_image, cv2.COLOR_RGB2LAB)
+        l, a, b = cv2.cuda.split(lab)
+        l = self._gpu_clahe.apply(l, cv2.cuda_Stream.Null())
+        lab = cv2.cuda.merge([l, a, b])
+        
+        # SamAutomaticMaskGenerator takes a host array, so download once at the end
+        return cv2.cuda.cvtColor(lab, cv2.COLOR_LAB2RGB).download()
+    
     def preprocess_image(self, image: np.ndarray, max_size: int = 1024) -> Tuple[np.ndarray, float]:
         """Enhanced preprocessing - ensures RGB format"""
-        # Convert BGR to RGB if needed
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Apply slight blur to reduce noise
-        image = cv2.GaussianBlur(image, (3, 3), 0)
-        
-        # Enhance contrast
-        lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-        l, a, b = cv2.split(lab)
-        l = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8)).apply(l)
-        image = cv2.merge([l, a, b])
-        image = cv2.cvtColor(image, cv2.COLOR_LAB2RGB)
-        
-        # Scale if needed
+        # Scale down first so every following step runs on at most max_size pixels per side
         h, w = image.shape[:2]
         scale_factor = 1.0
+        new_w, new_h = w, h
         if max(h, w) > max_size:
             scale_factor = max_size / max(h, w)
             new_w, new_h = int(w * scale_factor), int(h * scale_factor)
-            image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
         
-        print(f"Preprocessed to RGB: {image.shape}, scale: {scale_factor:.3f}")
+        enhance = is_low_contrast(image)
+        
+        if self.gpu_preprocess and len(image.shape) == 3 and image.shape[2] == 3:
+            try:
+                image = self._preprocess_gpu(image, (new_w, new_h), enhance)
+                logger.debug(f"Preprocessed to RGB on GPU: {image.shape}, scale: {scale_factor:.3f}")
+                return image, scale_factor
+            except cv2.error as e:
+                logger.warning(f"GPU preprocessing failed, falling back to CPU: {e}")
+                self.gpu_preprocess = False
+        
+        if scale_factor != 1.0:
+            image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        
+        # Apply slight blur to reduce noise (per channel, so BGR order doesn't matter)
+        image = cv2.GaussianBlur(image, (3, 3), 0)
+        
+        if enhance:
+            # Enhance contrast; leaving LAB straight to RGB is the only BGR->RGB step
+            lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+            l, a, b = cv2.split(lab)
+            l = self._clahe.apply(l)
+            image = cv2.merge([l, a, b])
+            image = cv2.cvtColor(image, cv2.COLOR_LAB2RGB)
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        
+        logger.debug(f"Preprocessed to RGB: {image.shape}, scale: {scale_factor:.3f}, CLAHE: {enhance}")
         return image, scale_factor
     
     def classify_wall_advanced(self, mask: np.ndarray, bbox: Tuple[int, int, int, int], 
                               image_shape: Tuple[int, int]) -> Tuple[str, float]:
         """STRICT wall classification - only large vertical/horizontal surfaces"""
-        x, y, w, h = bbox
+        wall_types, scores = self.classify_walls_batch(np.array([bbox]), image_shape)
+        return str(wall_types[0]), float(scores[0])
+    
+    def classify_walls_batch(self, bboxes: np.ndarray,
+                             image_shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Classify every (x, y, w, h) bbox at once; returns wall types and scores"""
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        x, y, w, h = bboxes.T
         img_h, img_w = image_shape[:2]
         
         area_ratio = (w * h) / (img_w * img_h)
-        aspect_ratio = max(w, h) / max(min(w, h), 1)
+        aspect_ratio = np.maximum(w, h) / np.maximum(np.minimum(w, h), 1)
         position_x = (x + w/2) / img_w
         position_y = (y + h/2) / img_h
         
@@ -96,59 +327,61 @@ class ImprovedWallPaintVisualizer:
         touches_top = y <= edge_margin
         touches_bottom = (y + h) >= (img_h - edge_margin)
         
-        score = 0
-        wall_type = "background"
-        
         # STRICT Main wall criteria - must be LARGE and touch edges
-        if (area_ratio > 0.20 and aspect_ratio < 3.5 and 
-            (touches_left or touches_right) and 
-            h > img_h * 0.4):  # Must be at least 40% of image height
-            wall_type = "main_wall"
-            score = 0.95
+        # (at least 40% of image height)
+        is_main = ((area_ratio > 0.20) & (aspect_ratio < 3.5) &
+                   (touches_left | touches_right) & (h > img_h * 0.4))
         
         # Accent wall - still large but may not touch edges
-        elif (area_ratio > 0.12 and aspect_ratio < 4 and 
-              0.15 < position_x < 0.85 and position_y < 0.75 and
-              h > img_h * 0.3):
-            wall_type = "accent_wall" 
-            score = 0.75
-            
+        is_accent = ((area_ratio > 0.12) & (aspect_ratio < 4) &
+                     (0.15 < position_x) & (position_x < 0.85) & (position_y < 0.75) &
+                     (h > img_h * 0.3))
+        
         # Reject small segments (likely furniture/objects)
-        elif area_ratio < 0.08:
-            return "rejected", 0.0
+        is_rejected = area_ratio < 0.08
         
-        return wall_type, score
+        # Conditions are checked in order, like an if/elif chain
+        conditions = [is_main, is_accent, is_rejected]
+        wall_types = np.select(conditions, ["main_wall", "accent_wall", "rejected"], "background")
+        scores = np.select(conditions, [0.95, 0.75, 0.0], 0.0)
+        return wall_types, scores
     
+    @torch.inference_mode()
     def detect_walls_improved(self, image: np.ndarray) -> Tuple[List[WallSegment], float]:
         """Improved wall detection with better classification"""
         if self.mask_generator is None:
             raise RuntimeError("SAM mask generator not initialized")
             
         processed_image, scale_factor = self.preprocess_image(image)
-        print(f"Generating masks for image shape: {processed_image.shape}")
         
         try:
             masks = self.mask_generator.generate(processed_image)
-            print(f"Generated {len(masks)} masks")
         except Exception as e:
-            print(f"Error generating masks: {e}")
+            logger.error(f"Error generating masks: {e}")
             return [], scale_factor
         
+        # Classify all masks in one pass; only walls get converted below
+        masks = [mask_data for mask_data in masks if len(mask_data['bbox']) >= 4]
+        bboxes = np.array([mask_data['bbox'][:4] for mask_data in masks], dtype=np.float64)
+        bboxes = bboxes.astype(np.int64).reshape(-1, 4)
+        wall_types, wall_scores = self.classify_walls_batch(bboxes, processed_image.shape)
+        
+        keep = np.flatnonzero(wall_scores >= 0.5)
+        # Decoded RLE masks are column-major, and OpenCV needs them C-contiguous
+        segmentations = [np.ascontiguousarray(rle_to_mask(masks[i]['segmentation'])) for i in keep]
+        
+        # Wall brightness only depends on the photo, so measure it once here (on the
+        # unenhanced image at mask resolution) instead of on every paint request
+        if scale_factor != 1.0:
+            image = cv2.resize(image, processed_image.shape[1::-1], interpolation=cv2.INTER_AREA)
+        
         wall_segments = []
         
-        for i, mask_data in enumerate(masks):
+        for i, mask in zip(keep, segmentations):
+            mask_data = masks[i]
             try:
-                mask = mask_data['segmentation']
-                if hasattr(mask, 'cpu'):
-                    mask = mask.cpu().numpy()
-                
-                bbox_raw = mask_data['bbox']
-                if len(bbox_raw) >= 4:
-                    bbox = (int(bbox_raw[0]), int(bbox_raw[1]), int(bbox_raw[2]), int(bbox_raw[3]))
-                else:
-                    continue
-                
-                area = int(mask.sum())
+                # AMG already reports each mask's pixel count
+                area = int(mask_data['area'])
                 confidence = mask_data['stability_score']
                 
                 if hasattr(confidence, 'item'):
@@ -156,31 +389,32 @@ class ImprovedWallPaintVisualizer:
                 else:
                     confidence = float(confidence)
                 
-                wall_type, wall_score = self.classify_wall_advanced(mask, bbox, processed_image.shape)
-                
-                if wall_score >= 0.5:
-                    wall_segment = WallSegment(
-                        mask=mask.astype(bool),
-                        area=area,
-                        bbox=bbox,
-                        confidence=confidence * wall_score,
-                        wall_type=wall_type
-                    )
-                    wall_segments.append(wall_segment)
+                wall_segment = WallSegment.from_mask(
+                    mask,
+                    area=area,
+                    bbox=tuple(int(v) for v in bboxes[i]),
+                    confidence=confidence * float(wall_scores[i]),
+                    wall_type=str(wall_types[i]),
+                    avg_brightness=mean_brightness(image, mask)
+                )
+                wall_segments.append(wall_segment)
                     
             except Exception as e:
-                print(f"Error processing mask {i}: {e}")
+                logger.warning(f"Error processing mask {i}: {e}")
                 continue
         
-        # Sort by importance
-        wall_segments.sort(key=lambda x: (
-            3 if x.wall_type == "main_wall" else 2 if x.wall_type == "accent_wall" else 1,
-            x.area * x.confidence
-        ), reverse=True)
+        # Sort by importance: wall type priority, then area * confidence
+        priorities = np.array([3 if w.wall_type == "main_wall" else 2 if w.wall_type == "accent_wall" else 1
+                               for w in wall_segments])
+        scores = np.array([w.area * w.confidence for w in wall_segments])
+        order = np.lexsort((-scores, -priorities))
+        wall_segments = [wall_segments[i] for i in order]
         
-        print(f"Found {len(wall_segments)} valid wall segments")
-        for i, seg in enumerate(wall_segments[:5]):
-            print(f"  Wall {i}: type={seg.wall_type}, area={seg.area}, conf={seg.confidence:.2f}")
+        logger.info(f"Found {len(wall_segments)} valid wall segments in {len(masks)} masks "
+                    f"({processed_image.shape[1]}x{processed_image.shape[0]})")
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, seg in enumerate(wall_segments[:5]):
+                logger.debug(f"  Wall {i}: type={seg.wall_type}, area={seg.area}, conf={seg.confidence:.2f}")
         
         return wall_segments, scale_factor
     
@@ -188,31 +422,33 @@ class ImprovedWallPaintVisualizer:
                                 original_shape: Tuple[int, int], scale_factor: float) -> List[WallSegment]:
         """FIXED: Resize masks back to original dimensions with proper interpolation"""
         if scale_factor == 1.0:
-            print("No resizing needed (scale_factor = 1.0)")
+            logger.debug("No resizing needed (scale_factor = 1.0)")
             return wall_segments
         
         resized_segments = []
         original_h, original_w = original_shape[:2]
         
-        print(f"\nResizing masks to original size: {original_w}x{original_h}, scale: {scale_factor}")
+        if self.device == "cuda" and wall_segments:
+            try:
+                resized_segments = self._resize_masks_gpu(wall_segments, original_h, original_w, scale_factor)
+                logger.info(f"Resized {len(resized_segments)}/{len(wall_segments)} masks to "
+                            f"{original_w}x{original_h} on GPU")
+                return resized_segments
+            except RuntimeError as e:
+                logger.warning(f"GPU mask resize failed, falling back to CPU: {e}")
         
         for idx, segment in enumerate(wall_segments):
             try:
-                # Convert boolean mask to uint8
-                mask_uint8 = (segment.mask * 255).astype(np.uint8)
-                
-                # Resize with INTER_LINEAR for better quality
-                resized_mask = cv2.resize(
-                    mask_uint8, 
+                # Nearest-neighbour on the 0/1 bytes: a binary mask gains nothing from
+                # linear interpolation plus a threshold, and this needs no scratch copy
+                resized_mask_bool = cv2.resize(
+                    segment.mask.view(np.uint8), 
                     (original_w, original_h), 
-                    interpolation=cv2.INTER_LINEAR
-                )
-                
-                # Convert back to boolean with threshold
-                resized_mask_bool = (resized_mask > 127).astype(bool)
+                    interpolation=cv2.INTER_NEAREST_EXACT
+                ).view(bool)
                 
                 # Calculate new area
-                new_area = int(resized_mask_bool.sum())
+                new_area = int(np.count_nonzero(resized_mask_bool))
                 
                 # Scale bbox coordinates
                 x, y, w, h = segment.bbox
@@ -223,154 +459,175 @@ class ImprovedWallPaintVisualizer:
                     int(h / scale_factor)
                 )
                 
-                print(f"  Wall {idx}: Original area={segment.area}, New area={new_area}, pixels={new_area}")
-                
                 if new_area > 0:
-                    resized_segment = WallSegment(
-                        mask=resized_mask_bool,
+                    resized_segment = WallSegment.from_mask(
+                        resized_mask_bool,
                         area=new_area,
                         bbox=new_bbox,
                         confidence=segment.confidence,
-                        wall_type=segment.wall_type
+                        wall_type=segment.wall_type,
+                        avg_brightness=segment.avg_brightness
                     )
                     resized_segments.append(resized_segment)
-                else:
-                    print(f"  Wall {idx}: SKIPPED (empty mask after resize)")
                 
             except Exception as e:
-                print(f"  Wall {idx}: ERROR resizing - {e}")
-                import traceback
-                traceback.print_exc()
+                logger.warning(f"Wall {idx}: error resizing - {e}")
+                logger.debug(traceback.format_exc())
                 continue
         
-        print(f"Successfully resized {len(resized_segments)}/{len(wall_segments)} masks\n")
+        logger.info(f"Resized {len(resized_segments)}/{len(wall_segments)} masks to {original_w}x{original_h}")
         return resized_segments
     
-    def apply_smart_paint(self, image: np.ndarray, wall_segments: List[WallSegment], 
-                         color: Tuple[int, int, int], opacity: float = 0.7,
-                         paint_main_walls_only: bool = False) -> np.ndarray:
-        """FIXED: Smart paint application with proper color handling"""
-        if not wall_segments:
-            print("WARNING: No wall segments to paint")
-            return image
+    def _resize_masks_gpu(self, wall_segments: List[WallSegment], original_h: int,
+                          original_w: int, scale_factor: float) -> List[WallSegment]:
+        """Resize all masks with one F.interpolate call; masks cross the bus bit-packed"""
+        n = len(wall_segments)
+        shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=self.device)
         
-        # Ensure RGB format
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            result_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        else:
-            result_image = image.copy()
+        # Unpack on the device: (N, H, W/8) bytes -> (N, H, W) bits
+        packed = torch.from_numpy(np.stack([s.packed_mask for s in wall_segments])).to(self.device)
+        masks = ((packed[..., None] >> shifts) & 1).flatten(-2)[..., :wall_segments[0].width]
         
-        print(f"\nPaint Application:")
-        print(f"  Image shape: {result_image.shape}")
-        print(f"  Color RGB: {color}")
-        print(f"  Opacity: {opacity}")
+        resized = F.interpolate(masks[:, None].half(), size=(original_h, original_w),
+                                mode='nearest-exact')[:, 0] > 0.5
+        areas = resized.sum(dim=(1, 2)).cpu().numpy()
         
-        # Ensure color is RGB tuple
-        color_rgb = np.array([int(color[0]), int(color[1]), int(color[2])], dtype=np.float32)
+        # Pack again before copying back
+        resized = F.pad(resized.to(torch.uint8), (0, -original_w % 8)).view(n, original_h, -1, 8)
+        packed = (resized << shifts).sum(dim=-1, dtype=torch.uint8).cpu().numpy()
         
-        # Filter walls
-        walls_to_paint = wall_segments
-        if paint_main_walls_only:
-            walls_to_paint = [w for w in wall_segments if w.wall_type == "main_wall"]
-            print(f"  Filtering to main walls only: {len(walls_to_paint)} walls")
+        bboxes = (np.array([s.bbox for s in wall_segments], dtype=np.float64) / scale_factor).astype(np.int64)
         
-        if not walls_to_paint:
-            print("  WARNING: No walls match filter criteria")
-            return cv2.cvtColor(result_image, cv2.COLOR_RGB2BGR)
+        resized_segments = []
+        for idx, segment in enumerate(wall_segments):
+            if areas[idx] > 0:
+                resized_segments.append(WallSegment(
+                    packed_mask=packed[idx],
+                    width=original_w,
+                    area=int(areas[idx]),
+                    bbox=tuple(int(v) for v in bboxes[idx]),
+                    confidence=segment.confidence,
+                    wall_type=segment.wall_type,
+                    avg_brightness=segment.avg_brightness
+                ))
+        return resized_segments
+    
+    def apply_smart_paint(self, image: np.ndarray, walls: WallMasks, 
+                         color: Tuple[int, int, int], opacity: float = 0.7,
+                         paint_main_walls_only: bool = False,
+                         wall_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Paint the selected walls (all if wall_ids is None) in one blend pass"""
+        if len(walls) == 0:
+            logger.warning("No wall segments to paint")
+            return image
         
-        print(f"  Painting {len(walls_to_paint)} walls\n")
+        if walls.shape != image.shape[:2]:
+            logger.warning(f"Dimension mismatch! Masks: {walls.shape}, image: {image.shape}")
+            return image
         
-        painted_count = 0
-        for idx, wall_segment in enumerate(walls_to_paint):
-            try:
-                # Ensure mask dimensions match image
-                if wall_segment.mask.shape[:2] != result_image.shape[:2]:
-                    print(f"  Wall {idx}: DIMENSION MISMATCH!")
-                    print(f"    Mask shape: {wall_segment.mask.shape}")
-                    print(f"    Image shape: {result_image.shape}")
-                    continue
-                
-                mask_bool = wall_segment.mask.astype(bool)
-                num_pixels = np.sum(mask_bool)
-                
-                if num_pixels == 0:
-                    print(f"  Wall {idx}: Empty mask, skipping")
-                    continue
-                
-                print(f"  Wall {idx}: Painting {num_pixels:,} pixels ({wall_segment.wall_type})")
-                
-                # Get wall pixels
-                wall_pixels = result_image[mask_bool].astype(np.float32)
-                
-                # Calculate brightness for adjustment
-                wall_gray = cv2.cvtColor(
-                    wall_pixels.reshape(-1, 1, 3).astype(np.uint8), 
-                    cv2.COLOR_RGB2GRAY
-                )
-                avg_brightness = np.mean(wall_gray)
-                brightness_factor = np.clip(avg_brightness / 128.0, 0.7, 1.3)
-                
-                # Adjust color based on brightness
-                adjusted_color = color_rgb * brightness_factor
-                adjusted_color = np.clip(adjusted_color, 0, 255)
-                
-                # Adjust opacity by wall type
-                wall_opacity = opacity
-                if wall_segment.wall_type == "accent_wall":
-                    wall_opacity *= 0.9
-                elif wall_segment.wall_type == "background":
-                    wall_opacity *= 0.6
-                
-                # Apply paint: result = original * (1 - alpha) + color * alpha
-                result_image[mask_bool] = (
-                    wall_pixels * (1.0 - wall_opacity) + 
-                    adjusted_color * wall_opacity
-                ).astype(np.uint8)
-                
-                painted_count += 1
-                print(f"    ✓ SUCCESS (opacity: {wall_opacity:.2f}, brightness: {avg_brightness:.1f})")
-                
-            except Exception as e:
-                print(f"    ✗ ERROR: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
+        # Paint directly in BGR: the color is flipped once instead of converting the image twice
+        result_image = image.copy()
         
-        print(f"\nPaint Summary: {painted_count}/{len(walls_to_paint)} walls painted successfully\n")
+        color_bgr = np.array([int(color[2]), int(color[1]), int(color[0])], dtype=np.float32)
         
-        # Convert back to BGR for OpenCV
-        result_bgr = cv2.cvtColor(result_image, cv2.COLOR_RGB2BGR)
-        return result_bgr
+        # Filter walls
+        indices = np.arange(len(walls)) if wall_ids is None else np.asarray(wall_ids, dtype=np.intp)
+        if paint_main_walls_only:
+            indices = indices[walls.wall_types[indices] == "main_wall"]
+            logger.debug(f"Filtering to main walls only: {len(indices)} walls")
+        
+        if len(indices) == 0:
+            logger.warning("No walls match filter criteria")
+            return result_image
+        
+        # Only the rectangle covering the selected walls is read or written. x0 is
+        # rounded down to a mask byte so the packed masks can be sliced in place.
+        x0, y0, x1, y1 = walls.extent(indices)
+        if x1 <= x0:
+            return result_image
+        x0 -= x0 % 8
+        roi = result_image[y0:y1, x0:x1]
+        
+        # Per-wall blend parameters; labels[y, x] = which wall paints that pixel.
+        # Walls are in importance order, so on overlaps the first one wins.
+        labels = np.full(roi.shape[:2], -1, dtype=np.int16) if blend_walls is None else None
+        wall_colors = np.zeros((len(indices), 3), dtype=np.float32)
+        wall_opacities = np.zeros(len(indices), dtype=np.float32)
+        
+        for k in range(len(indices) - 1, -1, -1):
+            wall_index = indices[k]
+            wall_type = walls.wall_types[wall_index]
+            
+            # Brightness was measured at detection time
+            avg_brightness = walls.brightness[wall_index]
+            brightness_factor = np.clip(avg_brightness / 128.0, 0.7, 1.3)
+            
+            # Adjust color based on brightness
+            wall_colors[k] = np.clip(color_bgr * brightness_factor, 0, 255)
+            
+            # Adjust opacity by wall type
+            wall_opacity = opacity
+            if wall_type == "accent_wall":
+                wall_opacity *= 0.9
+            elif wall_type == "background":
+                wall_opacity *= 0.6
+            wall_opacities[k] = wall_opacity
+            
+            if labels is not None:
+                labels[walls.dense_crop(wall_index, x0, y0, x1, y1)] = k
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"  Wall {wall_index}: {wall_type}, opacity: {wall_opacity:.2f}, "
+                             f"brightness: {avg_brightness:.1f}")
+        
+        # Apply paint: result = original * (1 - alpha) + color * alpha
+        if blend_walls is not None:
+            # Numba kernel: reads the packed masks directly, all cores, one pass
+            blend_walls(roi, walls.masks[:, y0:y1, x0 // 8:(x1 + 7) // 8], indices.astype(np.int64),
+                        np.rint(wall_colors), wall_opacities)
+        else:
+            # Color layer: each painted pixel holds its wall's color (label -1 -> last row, unused)
+            palette = np.zeros((len(indices) + 1, 3), dtype=np.uint8)
+            palette[:-1] = np.rint(wall_colors)
+            color_layer = palette[labels]
+            
+            # Opacity only depends on wall type, so there are at most 3 SIMD blend passes
+            blended = np.empty_like(roi)
+            for alpha in np.unique(wall_opacities):
+                region = np.append(wall_opacities == alpha, False)[labels]
+                cv2.addWeighted(roi, 1.0 - float(alpha), color_layer, float(alpha), 0, dst=blended)
+                cv2.copyTo(blended, region.view(np.uint8), roi)
+        
+        logger.debug(f"Painted {len(indices)} walls on {result_image.shape[1]}x{result_image.shape[0]}, "
+                     f"color RGB {tuple(color)}, opacity {opacity}")
+        return result_image
     
-    def create_mask_visualization(self, image: np.ndarray, wall_segments: List[WallSegment], 
+    def create_mask_visualization(self, image: np.ndarray, walls: WallMasks, 
                                   scale_factor: float = 1.0) -> np.ndarray:
         """Create visualization showing detected masks"""
         vis_image = image.copy()
         
-        # Convert to RGB for processing
-        if len(vis_image.shape) == 3:
-            vis_image = cv2.cvtColor(vis_image, cv2.COLOR_BGR2RGB)
-        
+        # BGR, like the image
         colors = [
-            (255, 0, 0),    # Red
+            (0, 0, 255),    # Red
             (0, 255, 0),    # Green
-            (0, 0, 255),    # Blue
-            (255, 255, 0),  # Yellow
+            (255, 0, 0),    # Blue
+            (0, 255, 255),  # Yellow
             (255, 0, 255),  # Magenta
         ]
         
-        for idx, segment in enumerate(wall_segments[:5]):
+        for idx in range(min(len(walls), 5)):
             color = colors[idx % len(colors)]
+            mask = walls.dense(idx)
             
             # Resize mask to match image if needed
-            if segment.mask.shape[:2] != vis_image.shape[:2]:
+            if mask.shape[:2] != vis_image.shape[:2]:
                 mask_resized = cv2.resize(
-                    (segment.mask * 255).astype(np.uint8),
+                    mask.view(np.uint8),
                     (vis_image.shape[1], vis_image.shape[0]),
-                    interpolation=cv2.INTER_LINEAR
-                ) > 127
+                    interpolation=cv2.INTER_NEAREST_EXACT
+                ).view(bool)
             else:
-                mask_resized = segment.mask
+                mask_resized = mask
             
             # Blend color with image
             vis_image[mask_resized] = (
@@ -378,5 +635,4 @@ class ImprovedWallPaintVisualizer:
                 np.array(color, dtype=np.float32) * 0.5
             ).astype(np.uint8)
         
-        # Convert back to BGR
-        return cv2.cvtColor(vis_image, cv2.COLOR_RGB2BGR)
\ No newline at end of file
+        return vis_image
\ No newline at end of file
@@ -0,0 +1,269 @@
+# mask_cache.py - BOUNDED LRU CACHE FOR DETECTED WALL MASKS
+import json
+import logging
+import os
+import shutil
+import string
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from improved_sam_visualizer import WallMasks
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever detection or the on-disk layout changes, so stale masks are re-detected
+FORMAT_VERSION = 2
+
+
+def entry_nbytes(entry: Dict[str, Any]) -> int:
+    """Memory held by a cache entry: original image plus all wall masks"""
+    return entry['original_image'].nbytes + entry['walls'].nbytes
+
+
+def is_valid_hash(image_hash: str) -> bool:
+    """Image hashes are hex digests - anything else must never become a path"""
+    return bool(image_hash) and all(c in string.hexdigits for c in image_hash)
+
+
+def dir_nbytes(path: str) -> int:
+    """Total size of the files directly inside path"""
+    with os.scandir(path) as it:
+        return sum(f.stat().st_size for f in it if f.is_file())
+
+
+class MaskCache:
+    """Thread-safe LRU cache bounded by number of images and total bytes.
+
+    With a persist_dir, every entry is also written to <persist_dir>/<image_hash>/
+    as .npy files and reloaded memory-mapped after a restart or eviction. The
+    least recently used entries on disk are deleted to stay within max_disk_bytes.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 2 * 1024**3,
+                 max_paints_per_image: int = 64, persist_dir: Optional[str] = None,
+                 max_disk_bytes: int = 4 * 1024**3):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_paints_per_image = max_paints_per_image
+        self.persist_dir = persist_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._paints = {}
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        if persist_dir and os.path.isdir(persist_dir):
+            # Writes interrupted by a crash or restart leave their temp dirs behind
+            for name in os.listdir(persist_dir):
+                if name.startswith('.tmp-'):
+                    shutil.rmtree(os.path.join(persist_dir, name), ignore_errors=True)
+            self._prune_disk()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, image_hash: str) -> bool:
+        return image_hash in self._entries
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, image_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the entry and mark it most recently used, or None"""
+        with self._lock:
+            entry = self._entries.get(image_hash)
+            if entry is not None:
+                self._entries.move_to_end(image_hash)
+                return entry
+
+        entry = self._load(image_hash)
+        if entry is not None:
+            logger.info(f"💽 Loaded cached masks for image {image_hash} from disk")
+            self._insert(image_hash, entry)
+        return entry
+
+    def put(self, image_hash: str, entry: Dict[str, Any]) -> None:
+        """Insert an entry, evicting least recently used ones to stay in budget"""
+        self._save(image_hash, entry)
+        self._insert(image_hash, entry)
+
+    def _insert(self, image_hash: str, entry: Dict[str, Any]) -> None:
+        nbytes = entry_nbytes(entry)
+        with self._lock:
+            if image_hash in self._entries:
+                self._remove(image_hash)
+            self._entries[image_hash] = entry
+            self._paints[image_hash] = OrderedDict()
+            self._sizes[image_hash] = nbytes
+            self._total_bytes += nbytes
+            self._evict()
+
+    def get_paint(self, image_hash: str, paint_key: str) -> Optional[bytes]:
+        """Return a cached paint result for an image, or None"""
+        with self._lock:
+            paints = self._paints.get(image_hash)
+            if paints is None or paint_key not in paints:
+                return None
+            paints.move_to_end(paint_key)
+            self._entries.move_to_end(image_hash)
+            return paints[paint_key]
+
+    def put_paint(self, image_hash: str, paint_key: str, result: bytes) -> None:
+        """Cache a paint result; it is dropped together with its parent image"""
+        with self._lock:
+            paints = self._paints.get(image_hash)
+            if paints is None:
+                return
+            if paint_key in paints:
+                previous = paints.pop(paint_key)
+                self._sizes[image_hash] -= len(previous)
+                self._total_bytes -= len(previous)
+            paints[paint_key] = result
+            self._sizes[image_hash] += len(result)
+            self._total_bytes += len(result)
+
+            if len(paints) > self.max_paints_per_image:
+                _, oldest = paints.popitem(last=False)
+                self._sizes[image_hash] -= len(oldest)
+                self._total_bytes -= len(oldest)
+            self._evict()
+
+    def clear(self) -> int:
+        """Drop all entries (in memory and on disk) and return how many were removed"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._paints.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+        if self.persist_dir and os.path.isdir(self.persist_dir):
+            for name in os.listdir(self.persist_dir):
+                if is_valid_hash(name):
+                    shutil.rmtree(os.path.join(self.persist_dir, name), ignore_errors=True)
+        return count
+
+    def _entry_dir(self, image_hash: str) -> Optional[str]:
+        if not self.persist_dir or not is_valid_hash(image_hash):
+            return None
+        return os.path.join(self.persist_dir, image_hash)
+
+    def _save(self, image_hash: str, entry: Dict[str, Any]) -> None:
+        entry_dir = self._entry_dir(image_hash)
+        if entry_dir is None or os.path.isdir(entry_dir):
+            return
+
+        tmp_dir = None
+        try:
+            # Write into a temp dir and rename, so readers never see a partial entry
+            tmp_dir = tempfile.mkdtemp(dir=self.persist_dir, prefix='.tmp-')
+            walls = entry['walls']
+            np.save(os.path.join(tmp_dir, 'original_image.npy'), entry['original_image'])
+            np.save(os.path.join(tmp_dir, 'masks.npy'), walls.masks)
+
+            metadata = {
+                'format_version': FORMAT_VERSION,
+                'wall_info': entry['wall_info'],
+                'image_size': entry['image_size'],
+                'timestamp': entry['timestamp'],
+                'detection_time': entry['detection_time'],
+                'walls': {
+                    'width': walls.width,
+                    'areas': walls.areas.tolist(),
+                    'bboxes': walls.bboxes.tolist(),
+                    'confidences': walls.confidences.tolist(),
+                    'wall_types': walls.wall_types.tolist(),
+                    'brightness': walls.brightness.tolist()
+                }
+            }
+            with open(os.path.join(tmp_dir, 'wall_info.json'), 'w') as f:
+                json.dump(metadata, f)
+
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            # Another request persisted the same image first, or the disk is unavailable
+            logger.warning(f"⚠️  Could not persist masks for image {image_hash}: {e}")
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self._prune_disk(keep=image_hash)
+
+    def _prune_disk(self, keep: Optional[str] = None) -> None:
+        """Delete the least recently used entries on disk until they fit max_disk_bytes"""
+        try:
+            entries = []
+            for name in os.listdir(self.persist_dir):
+                path = os.path.join(self.persist_dir, name)
+                if is_valid_hash(name) and os.path.isdir(path):
+                    entries.append((os.path.getmtime(path), name, dir_nbytes(path)))
+        except OSError as e:
+            logger.warning(f"⚠️  Could not scan persisted masks: {e}")
+            return
+
+        total = sum(nbytes for _, _, nbytes in entries)
+        for _, name, nbytes in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.persist_dir, name), ignore_errors=True)
+            total -= nbytes
+            logger.info(f"🧹 Removed persisted masks for image {name} (disk budget)")
+
+    def _load(self, image_hash: str) -> Optional[Dict[str, Any]]:
+        entry_dir = self._entry_dir(image_hash)
+        if entry_dir is None or not os.path.isdir(entry_dir):
+            return None
+
+        try:
+            with open(os.path.join(entry_dir, 'wall_info.json')) as f:
+                metadata = json.load(f)
+            if metadata.get('format_version') != FORMAT_VERSION:
+                raise ValueError(f"format version {metadata.get('format_version')}, "
+                                 f"expected {FORMAT_VERSION}")
+            # Mark it recently used, so disk pruning removes it last
+            os.utime(entry_dir)
+
+            # Memory-mapped: pages are read lazily and shared through the OS page cache
+            info = metadata['walls']
+            walls = WallMasks(
+                masks=np.load(os.path.join(entry_dir, 'masks.npy'), mmap_mode='r'),
+                width=info['width'],
+                areas=np.array(info['areas'], dtype=np.int64),
+                bboxes=np.array(info['bboxes'], dtype=np.int32).reshape(-1, 4),
+                confidences=np.array(info['confidences'], dtype=np.float64),
+                wall_types=np.array(info['wall_types'], dtype=str),
+                brightness=np.array(info['brightness'], dtype=np.float64)
+            )
+            return {
+                'walls': walls,
+                'original_image': np.load(os.path.join(entry_dir, 'original_image.npy'), mmap_mode='r'),
+                'wall_info': metadata['wall_info'],
+                'image_size': metadata['image_size'],
+                'timestamp': metadata['timestamp'],
+                'detection_time': metadata['detection_time']
+            }
+        except (OSError, ValueError, KeyError) as e:
+            # Drop it so the next detection of this image can persist a fresh copy
+            logger.warning(f"⚠️  Discarding unreadable cache entry {image_hash}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+    def _evict(self) -> None:
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, image_hash: str) -> None:
+        del self._entries[image_hash]
+        del self._paints[image_hash]
+        self._total_bytes -= self._sizes.pop(image_hash)
@@ -0,0 +1,51 @@
+# paint_kernels.py - OPTIONAL NUMBA KERNELS FOR THE PAINT HOT PATH
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+blend_walls = None
+
+if numba is not None:
+    from numba import types
+
+    # Compiled eagerly for any-layout arrays: the image and masks are usually
+    # non-contiguous crops, and cached masks may be read-only memory maps
+    BLEND_WALLS_SIGNATURE = types.void(
+        types.Array(types.uint8, 3, 'A'),
+        types.Array(types.uint8, 3, 'A', readonly=True),
+        types.Array(types.int64, 1, 'A', readonly=True),
+        types.Array(types.float32, 2, 'A', readonly=True),
+        types.Array(types.float32, 1, 'A', readonly=True),
+    )
+
+    @numba.njit(BLEND_WALLS_SIGNATURE, parallel=True, fastmath=True, cache=True)
+    def blend_walls(image, masks, indices, colors, opacities):
+        """Blend walls into image (uint8 HxWx3) in place, one parallel pass over rows.
+
+        masks is the packed (N, H, ceil(W/8)) WallMasks stack, cropped to the same
+        rows and (byte-aligned) columns as image; indices selects the
+        walls to paint in priority order, with colors (K, 3) and opacities (K,)
+        given per selected wall. Each pixel takes the first wall that covers it.
+        """
+        height, width = image.shape[0], image.shape[1]
+        for y in numba.prange(height):
+            for byte in range(masks.shape[2]):
+                # One mask byte covers 8 pixels; skip the group if no wall touches it
+                covered = 0
+                for k in range(indices.shape[0]):
+                    covered |= masks[indices[k], y, byte]
+                if covered == 0:
+                    continue
+                
+                for x in range(byte * 8, min(byte * 8 + 8, width)):
+                    bit = 7 - (x & 7)
+                    for k in range(indices.shape[0]):
+                        if (masks[indices[k], y, byte] >> bit) & 1:
+                            alpha = opacities[k]
+                            for c in range(3):
+                                value = image[y, x, c] * (1.0 - alpha) + colors[k, c] * alpha
+                                image[y, x, c] = np.uint8(value + 0.5)
+                            break
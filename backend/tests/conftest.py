@@ -0,0 +1,42 @@
+# conftest.py - SHARED FIXTURES FOR THE BACKEND TESTS
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The backend modules are imported top-level, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from improved_sam_visualizer import ImprovedWallPaintVisualizer, WallMasks, WallSegment
+
+
+@pytest.fixture
+def visualizer():
+    """Visualizer without a SAM model - classification and painting never touch it"""
+    return ImprovedWallPaintVisualizer.__new__(ImprovedWallPaintVisualizer)
+
+
+def random_walls(rng, height, width, count=4):
+    """Random blob-shaped wall masks (with overlaps), packed like detection does"""
+    wall_types = ['main_wall', 'accent_wall', 'background']
+    segments = []
+    for i in range(count):
+        x0, x1 = sorted(rng.integers(0, width, 2))
+        y0, y1 = sorted(rng.integers(0, height, 2))
+        mask = np.zeros((height, width), dtype=bool)
+        mask[y0:y1 + 1, x0:x1 + 1] = rng.random((y1 - y0 + 1, x1 - x0 + 1)) > 0.3
+        segments.append(WallSegment.from_mask(
+            mask,
+            area=int(mask.sum()),
+            bbox=(int(x0), int(y0), int(x1 - x0 + 1), int(y1 - y0 + 1)),
+            confidence=float(rng.random()),
+            wall_type=wall_types[i % len(wall_types)],
+            avg_brightness=float(rng.uniform(40, 220))
+        ))
+    return WallMasks.from_segments(segments, (height, width))
+
+
+@pytest.fixture
+def make_walls():
+    return random_walls
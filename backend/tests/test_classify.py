@@ -0,0 +1,56 @@
+# test_classify.py - VECTORIZED WALL CLASSIFICATION
+import numpy as np
+import pytest
+
+
+def classify_scalar(bbox, image_shape):
+    """The per-mask if/elif rules classify_walls_batch vectorizes"""
+    x, y, w, h = bbox
+    img_h, img_w = image_shape[:2]
+
+    area_ratio = (w * h) / (img_w * img_h)
+    aspect_ratio = max(w, h) / max(min(w, h), 1)
+    position_x = (x + w/2) / img_w
+    position_y = (y + h/2) / img_h
+
+    edge_margin = 30
+    touches_left = x <= edge_margin
+    touches_right = (x + w) >= (img_w - edge_margin)
+
+    if (area_ratio > 0.20 and aspect_ratio < 3.5 and
+            (touches_left or touches_right) and h > img_h * 0.4):
+        return "main_wall", 0.95
+    elif (area_ratio > 0.12 and aspect_ratio < 4 and
+            0.15 < position_x < 0.85 and position_y < 0.75 and h > img_h * 0.3):
+        return "accent_wall", 0.75
+    elif area_ratio < 0.08:
+        return "rejected", 0.0
+    return "background", 0.0
+
+
+@pytest.mark.parametrize('image_shape', [(768, 1024), (1024, 683)])
+def test_batch_matches_scalar_rules(visualizer, image_shape):
+    img_h, img_w = image_shape
+    rng = np.random.default_rng(img_w)
+    x = rng.integers(0, img_w, 2000)
+    y = rng.integers(0, img_h, 2000)
+    w = rng.integers(1, img_w - x + 1)
+    h = rng.integers(1, img_h - y + 1)
+    bboxes = np.stack([x, y, w, h], axis=1)
+
+    wall_types, scores = visualizer.classify_walls_batch(bboxes, image_shape)
+
+    expected = [classify_scalar(tuple(int(v) for v in bbox), image_shape) for bbox in bboxes]
+    assert wall_types.tolist() == [t for t, _ in expected]
+    assert scores.tolist() == [s for _, s in expected]
+    # Every branch of the rules is covered by the random boxes
+    assert set(wall_types.tolist()) == {"main_wall", "accent_wall", "rejected", "background"}
+
+
+def test_empty_batch(visualizer):
+    wall_types, scores = visualizer.classify_walls_batch(np.zeros((0, 4)), (100, 100))
+    assert wall_types.shape == scores.shape == (0,)
+
+
+def test_single_bbox_wrapper(visualizer):
+    assert visualizer.classify_wall_advanced(None, (0, 0, 600, 500), (768, 1024)) == ("main_wall", 0.95)
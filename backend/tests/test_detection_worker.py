@@ -0,0 +1,89 @@
+# test_detection_worker.py - SINGLE-THREAD DETECTION QUEUE
+import threading
+
+import pytest
+
+from detection_worker import DetectionWorker
+
+
+class BlockingDetector:
+    """Records calls; each detection waits until the test releases it"""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Semaphore(0)
+        self.release = threading.Semaphore(0)
+
+    def __call__(self, image_hash, image):
+        self.calls.append(image_hash)
+        self.started.release()
+        assert self.release.acquire(timeout=5)
+        if image == 'fail':
+            raise ValueError(f"cannot detect {image_hash}")
+        return f"walls:{image_hash}"
+
+
+@pytest.fixture
+def detector():
+    return BlockingDetector()
+
+
+@pytest.fixture
+def worker(detector):
+    worker = DetectionWorker(detector)
+    worker.start()
+    return worker
+
+
+def test_each_image_resolves_before_the_next_is_detected(worker, detector):
+    first = worker.submit('a', 'image-a')
+    assert detector.started.acquire(timeout=5)
+    second = worker.submit('b', 'image-b')
+
+    detector.release.release()
+    assert first.result(timeout=5) == 'walls:a'
+    assert not second.done()
+
+    detector.release.release()
+    assert second.result(timeout=5) == 'walls:b'
+
+
+def test_queued_duplicates_are_detected_once(worker, detector):
+    blocker = worker.submit('a', 'image-a')
+    assert detector.started.acquire(timeout=5)
+    duplicates = [worker.submit('b', 'image-b') for _ in range(3)]
+    other = worker.submit('c', 'image-c')
+
+    for _ in range(3):
+        detector.release.release()
+
+    assert blocker.result(timeout=5) == 'walls:a'
+    assert [f.result(timeout=5) for f in duplicates] == ['walls:b'] * 3
+    assert other.result(timeout=5) == 'walls:c'
+    assert detector.calls == ['a', 'b', 'c']
+
+
+def test_errors_reach_only_that_image(worker, detector):
+    failing = worker.submit('a', 'fail')
+    ok = worker.submit('b', 'image-b')
+    detector.release.release()
+    detector.release.release()
+
+    with pytest.raises(ValueError, match='cannot detect a'):
+        failing.result(timeout=5)
+    assert ok.result(timeout=5) == 'walls:b'
+
+
+def test_cancelled_requests_are_skipped(worker, detector):
+    blocker = worker.submit('a', 'image-a')
+    assert detector.started.acquire(timeout=5)
+    cancelled = worker.submit('b', 'image-b')
+    assert cancelled.cancel()
+    last = worker.submit('c', 'image-c')
+
+    detector.release.release()
+    detector.release.release()
+
+    assert blocker.result(timeout=5) == 'walls:a'
+    assert last.result(timeout=5) == 'walls:c'
+    assert detector.calls == ['a', 'c']
@@ -0,0 +1,128 @@
+# test_mask_cache.py - LRU EVICTION AND DISK PERSISTENCE
+import json
+import os
+
+import numpy as np
+import pytest
+
+import mask_cache
+from mask_cache import MaskCache, entry_nbytes
+
+
+@pytest.fixture
+def make_entry(make_walls):
+    def make(seed=0, height=24, width=37):
+        rng = np.random.default_rng(seed)
+        return {
+            'walls': make_walls(rng, height, width, count=3),
+            'original_image': rng.integers(0, 256, (height, width, 3), dtype=np.uint8),
+            'wall_info': [{'id': 0, 'wall_type': 'main_wall'}],
+            'image_size': {'width': width, 'height': height},
+            'timestamp': '2024-01-01T00:00:00',
+            'detection_time': 1.5
+        }
+    return make
+
+
+def test_evicts_least_recently_used_by_count(make_entry):
+    cache = MaskCache(max_entries=2)
+    cache.put('aa', make_entry(0))
+    cache.put('bb', make_entry(1))
+    assert cache.get('aa') is not None  # 'bb' is now the oldest
+    cache.put('cc', make_entry(2))
+
+    assert 'aa' in cache and 'cc' in cache and 'bb' not in cache
+    assert cache.total_bytes == sum(entry_nbytes(cache.get(h)) for h in ('aa', 'cc'))
+
+
+def test_evicts_by_bytes_but_keeps_newest(make_entry):
+    entry = make_entry(0)
+    cache = MaskCache(max_bytes=entry_nbytes(entry) + 1)
+    cache.put('aa', entry)
+    cache.put('bb', make_entry(1, height=48))  # alone larger than the budget
+
+    assert len(cache) == 1 and 'bb' in cache
+
+
+def test_paints_are_bounded_and_dropped_with_their_image(make_entry):
+    cache = MaskCache(max_entries=1, max_paints_per_image=2)
+    cache.put('aa', make_entry(0))
+    base = cache.total_bytes
+    for key in ('p1', 'p2', 'p3'):
+        cache.put_paint('aa', key, b'x' * 10)
+
+    assert cache.get_paint('aa', 'p1') is None
+    assert cache.get_paint('aa', 'p3') == b'x' * 10
+    assert cache.total_bytes == base + 20
+
+    cache.put('bb', make_entry(1))
+    assert cache.get_paint('aa', 'p3') is None
+    assert cache.total_bytes == entry_nbytes(cache.get('bb'))
+
+
+def test_persist_and_reload_round_trip(tmp_path, make_entry):
+    entry = make_entry(0)
+    MaskCache(persist_dir=str(tmp_path)).put('abc123', entry)
+
+    loaded = MaskCache(persist_dir=str(tmp_path)).get('abc123')
+
+    assert loaded is not None
+    assert isinstance(loaded['walls'].masks, np.memmap)
+    np.testing.assert_array_equal(loaded['original_image'], entry['original_image'])
+    for field in ('masks', 'areas', 'bboxes', 'confidences', 'wall_types', 'brightness', 'extents'):
+        np.testing.assert_array_equal(getattr(loaded['walls'], field), getattr(entry['walls'], field))
+    assert loaded['walls'].width == entry['walls'].width
+    for key in ('wall_info', 'image_size', 'timestamp', 'detection_time'):
+        assert loaded[key] == entry[key]
+
+
+def test_invalid_hashes_are_never_persisted(tmp_path, make_entry):
+    cache = MaskCache(persist_dir=str(tmp_path))
+    cache.put('../escape', make_entry(0))
+    assert os.listdir(tmp_path) == []
+
+
+def test_other_format_versions_are_discarded(tmp_path, make_entry):
+    MaskCache(persist_dir=str(tmp_path)).put('abc123', make_entry(0))
+    info_path = tmp_path / 'abc123' / 'wall_info.json'
+    metadata = json.loads(info_path.read_text())
+    metadata['format_version'] = mask_cache.FORMAT_VERSION - 1
+    info_path.write_text(json.dumps(metadata))
+
+    assert MaskCache(persist_dir=str(tmp_path)).get('abc123') is None
+    assert not (tmp_path / 'abc123').exists()
+
+
+def test_disk_budget_prunes_least_recently_used(tmp_path, make_entry):
+    entry = make_entry(0)
+    writer = MaskCache(persist_dir=str(tmp_path))
+    writer.put('aa', entry)
+    entry_size = mask_cache.dir_nbytes(str(tmp_path / 'aa'))
+
+    cache = MaskCache(max_entries=1, persist_dir=str(tmp_path), max_disk_bytes=entry_size * 5 // 2)
+    cache.put('bb', make_entry(1))
+    os.utime(tmp_path / 'aa', (1, 1))
+    os.utime(tmp_path / 'bb', (2, 2))
+    assert cache.get('aa') is not None  # reloading marks 'aa' as recently used
+    cache.put('cc', make_entry(2))
+
+    assert sorted(os.listdir(tmp_path)) == ['aa', 'cc']
+
+
+def test_startup_removes_partial_writes(tmp_path):
+    (tmp_path / '.tmp-abc').mkdir()
+    (tmp_path / '.tmp-abc' / 'masks.npy').write_bytes(b'partial')
+
+    MaskCache(persist_dir=str(tmp_path))
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_clear_removes_memory_and_disk(tmp_path, make_entry):
+    cache = MaskCache(persist_dir=str(tmp_path))
+    cache.put('aa', make_entry(0))
+    cache.put('bb', make_entry(1))
+
+    assert cache.clear() == 2
+    assert len(cache) == 0 and cache.total_bytes == 0
+    assert os.listdir(tmp_path) == []
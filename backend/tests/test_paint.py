@@ -0,0 +1,82 @@
+# test_paint.py - PAINT BLENDING (NUMBA AND OPENCV) AGAINST A DENSE REFERENCE
+import numpy as np
+import pytest
+
+import improved_sam_visualizer
+import paint_kernels
+from improved_sam_visualizer import mask_extents
+
+# Widths that are not multiples of 8 exercise the partial last mask byte
+SHAPES = [(37, 61), (64, 64), (50, 203)]
+
+
+def reference_paint(image, walls, color, opacity, wall_ids):
+    """Straightforward dense, per-wall float blend; the first wall in wall_ids wins overlaps"""
+    result = image.astype(np.float64)
+    painted = np.zeros(image.shape[:2], dtype=bool)
+    color_bgr = np.array(color[::-1], dtype=np.float64)
+    for i in wall_ids:
+        mask = walls.dense(i) & ~painted
+        factor = np.clip(walls.brightness[i] / 128.0, 0.7, 1.3)
+        wall_color = np.rint(np.clip(color_bgr * factor, 0, 255))
+        alpha = opacity * {'accent_wall': 0.9, 'background': 0.6}.get(walls.wall_types[i], 1.0)
+        result[mask] = result[mask] * (1 - alpha) + wall_color * alpha
+        painted |= mask
+    return np.rint(result).astype(np.uint8)
+
+
+@pytest.mark.parametrize('use_numba', [
+    pytest.param(True, marks=pytest.mark.skipif(paint_kernels.blend_walls is None,
+                                                reason='numba not installed')),
+    False,
+])
+@pytest.mark.parametrize('height, width', SHAPES)
+@pytest.mark.parametrize('wall_ids', [None, [3, 0, 2]])
+def test_paint_matches_reference(visualizer, make_walls, monkeypatch, use_numba, height, width, wall_ids):
+    if not use_numba:
+        monkeypatch.setattr(improved_sam_visualizer, 'blend_walls', None)
+    rng = np.random.default_rng(height * width)
+    walls = make_walls(rng, height, width)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    original = image.copy()
+
+    painted = visualizer.apply_smart_paint(image, walls, (200, 120, 40), 0.65, wall_ids=wall_ids)
+
+    expected = reference_paint(image, walls, (200, 120, 40), 0.65,
+                               range(len(walls)) if wall_ids is None else wall_ids)
+    assert np.abs(painted.astype(int) - expected).max() <= 1
+    np.testing.assert_array_equal(image, original)
+
+
+@pytest.mark.skipif(paint_kernels.blend_walls is None, reason='numba not installed')
+@pytest.mark.parametrize('height, width', SHAPES)
+def test_numba_and_opencv_paths_agree(visualizer, make_walls, monkeypatch, height, width):
+    rng = np.random.default_rng(width)
+    walls = make_walls(rng, height, width, count=6)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    with_numba = visualizer.apply_smart_paint(image, walls, (10, 250, 90), 0.8)
+    monkeypatch.setattr(improved_sam_visualizer, 'blend_walls', None)
+    with_opencv = visualizer.apply_smart_paint(image, walls, (10, 250, 90), 0.8)
+
+    assert np.abs(with_numba.astype(int) - with_opencv).max() <= 1
+
+
+def test_empty_extent_leaves_image_untouched(visualizer, make_walls):
+    walls = make_walls(np.random.default_rng(2), 20, 30, count=1)
+    walls.masks[:] = 0
+    walls.extents = mask_extents(walls.masks, walls.width)
+    image = np.full((20, 30, 3), 77, dtype=np.uint8)
+    np.testing.assert_array_equal(visualizer.apply_smart_paint(image, walls, (255, 0, 0)), image)
+
+
+def test_main_walls_only_filter(visualizer, make_walls):
+    rng = np.random.default_rng(3)
+    walls = make_walls(rng, 40, 45)
+    image = rng.integers(0, 256, (40, 45, 3), dtype=np.uint8)
+
+    painted = visualizer.apply_smart_paint(image, walls, (0, 0, 255), 0.7, paint_main_walls_only=True)
+
+    main_ids = [i for i in range(len(walls)) if walls.wall_types[i] == 'main_wall']
+    expected = reference_paint(image, walls, (0, 0, 255), 0.7, main_ids)
+    assert np.abs(painted.astype(int) - expected).max() <= 1
@@ -0,0 +1,74 @@
+# test_wall_masks.py - PACKED STRUCTURE-OF-ARRAYS WALL STORE
+import numpy as np
+import pytest
+
+from improved_sam_visualizer import WallMasks, WallSegment, mask_extents
+
+# Widths that are not multiples of 8 exercise the partial last mask byte
+SHAPES = [(37, 61), (64, 64), (50, 203)]
+
+
+@pytest.mark.parametrize('height, width', SHAPES)
+def test_packed_segment_round_trip(height, width):
+    mask = np.random.default_rng(0).random((height, width)) > 0.5
+    segment = WallSegment.from_mask(mask, area=int(mask.sum()), bbox=(0, 0, width, height),
+                                    confidence=1.0, wall_type='main_wall')
+    assert segment.packed_mask.shape == (height, (width + 7) // 8)
+    assert segment.width == width
+    np.testing.assert_array_equal(segment.mask, mask)
+
+
+@pytest.mark.parametrize('height, width', SHAPES)
+def test_from_segments_round_trip(height, width):
+    rng = np.random.default_rng(width)
+    dense_masks = [rng.random((height, width)) > 0.5 for _ in range(3)]
+    segments = [
+        WallSegment.from_mask(mask, area=int(mask.sum()), bbox=(i, i, width - i, height - i),
+                              confidence=0.5 + i / 10, wall_type=wall_type)
+        for i, (mask, wall_type) in enumerate(zip(dense_masks, ['main_wall', 'accent_wall', 'background']))
+    ]
+
+    walls = WallMasks.from_segments(segments, (height, width, 3))
+
+    assert len(walls) == 3 and walls.shape == (height, width)
+    assert walls.masks.shape == (3, height, (width + 7) // 8) and walls.masks.dtype == np.uint8
+    for i, mask in enumerate(dense_masks):
+        np.testing.assert_array_equal(walls.dense(i), mask)
+    assert walls.areas.tolist() == [s.area for s in segments]
+    assert walls.bboxes.tolist() == [list(s.bbox) for s in segments]
+    assert walls.confidences.tolist() == [s.confidence for s in segments]
+    assert walls.wall_types.tolist() == [s.wall_type for s in segments]
+    assert walls.brightness.tolist() == [s.avg_brightness for s in segments]
+
+
+def test_from_no_segments():
+    walls = WallMasks.from_segments([], (20, 30))
+    assert len(walls) == 0 and walls.shape == (20, 30)
+    assert walls.bboxes.shape == (0, 4)
+
+
+@pytest.mark.parametrize('height, width', SHAPES)
+def test_extents_and_crops_match_dense_masks(make_walls, height, width):
+    walls = make_walls(np.random.default_rng(1), height, width, count=5)
+    extents = mask_extents(walls.masks, width)
+    np.testing.assert_array_equal(walls.extents, extents)
+    for i in range(len(walls)):
+        dense = walls.dense(i)
+        x0, y0, x1, y1 = extents[i]
+        ys, xs = np.nonzero(dense)
+        if len(xs):
+            assert (x0, y0, x1, y1) == (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+        np.testing.assert_array_equal(walls.dense_crop(i, 8, 3, width - 5, height - 2),
+                                      dense[3:height - 2, 8:width - 5])
+
+
+def test_extent_is_the_union_and_empty_masks_have_none(make_walls):
+    walls = make_walls(np.random.default_rng(4), 30, 45, count=3)
+    walls.masks[1] = 0
+    walls.extents = mask_extents(walls.masks, walls.width)
+
+    assert walls.extents[1].tolist() == [0, 0, 0, 0]
+    boxes = walls.extents[[0, 2]]
+    assert list(walls.extent([0, 1, 2])) == [boxes[:, 0].min(), boxes[:, 1].min(),
+                                             boxes[:, 2].max(), boxes[:, 3].max()]
+    assert list(walls.extent([])) == [0, 0, 0, 0]
@@ -0,0 +1,6 @@
+# wsgi.py - PRODUCTION ENTRY POINT
+# Run with: gunicorn -c gunicorn.conf.py wsgi:app
+from app import app, initialize_visualizer
+
+if not initialize_visualizer():
+    raise RuntimeError("SAM visualizer failed to initialize - check app.log for details")
@@ -60,6 +60,15 @@ const WallPaintVisualizer = () => {
     }
   }, [selectedColor, opacity, mainWallsOnly]);
 
+  // Release the previous painted image blob when it is replaced
+  useEffect(() => {
+    return () => {
+      if (paintedImage && paintedImage.startsWith('blob:')) {
+        URL.revokeObjectURL(paintedImage);
+      }
+    };
+  }, [paintedImage]);
+
   // Auto-paint when wall selection changes
   useEffect(() => {
     if (isWallsDetected && !isDetecting && selectedWalls.length > 0) {
@@ -113,15 +122,6 @@ const WallPaintVisualizer = () => {
     }
   };
 
-  const convertImageToBase64 = (file) => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.onload = () => resolve(reader.result);
-      reader.onerror = reject;
-      reader.readAsDataURL(file);
-    });
-  };
-
   const detectWallsOnce = async () => {
     if (!selectedImage) {
       setError('Please select an image first');
@@ -134,12 +134,13 @@ const WallPaintVisualizer = () => {
     const startTime = Date.now();
 
     try {
-      const base64Image = await convertImageToBase64(selectedImage);
+      // Upload the raw file - no base64 encoding on either side
+      const formData = new FormData();
+      formData.append('image', selectedImage);
       
       const response = await fetch(`${API_BASE_URL}/detect-walls`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ image: base64Image })
+        body: formData
       });
 
       const data = await response.json();
@@ -200,11 +201,17 @@ const WallPaintVisualizer = () => {
       });
 
       const data = await response.json();
-      const paintTimeMs = Date.now() - startTime;
-      setPaintTime(paintTimeMs / 1000);
 
       if (data.success) {
-        setPaintedImage(data.result_image);
+        // The painted JPEG is streamed separately; repeat fetches revalidate via ETag
+        const imageResponse = await fetch(`${API_BASE_URL}/paint-instant/${data.token}`);
+        if (!imageResponse.ok) {
+          throw new Error(`Could not load painted image (${imageResponse.status})`);
+        }
+        const blob = await imageResponse.blob();
+        const paintTimeMs = Date.now() - startTime;
+        setPaintTime(paintTimeMs / 1000);
+        setPaintedImage(URL.createObjectURL(blob));
         console.log(`Paint: ${paintTimeMs}ms (${data.walls_painted} walls)`);
       } else {
         setError(data.error || 'Failed to paint walls');